@@ -1,97 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+import functools
+import hashlib
+from itertools import repeat
 import json
+import math
+from operator import itemgetter
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import paramiko
 import requests
-from scp import SCPClient
+from requests.adapters import HTTPAdapter
+import select
+import shlex
+import shutil
+import threading
 import time
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator
 import os
 
+# On-disk cache of the latest Ubuntu AMI ID, which only changes every few weeks
+AMI_CACHE_PATH = os.path.expanduser("~/.cache/iac_ami.json")
+AMI_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Bake the AMI with the cluster dependencies already installed (see CLUSTER_AMI_NAME)
+BAKE_CLUSTER_AMI = os.getenv("IAC_BAKE_AMI") == "1"
+
+# The key pair is kept for the next runs, unless IAC_EPHEMERAL_KEY=1 (then deleted in cleanup)
+EPHEMERAL_KEY_PAIR = os.getenv("IAC_EPHEMERAL_KEY") == "1"
+
+# Benchmark: number of queries of each kind, and how many are in flight at once
+BENCHMARK_N_QUERIES = 1000
+BENCHMARK_CONCURRENCY = 16
+BENCHMARK_WRITE_QUERY = (
+    "INSERT INTO actor (first_name, last_name) VALUES ('John', 'Doe')"
+)
+BENCHMARK_READ_QUERY = "SELECT COUNT(*) AS total_entries FROM actor;"
+
+# Headers of the requests whose body is already encoded JSON
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Maximum number of kept-alive connections to the gatekeeper (at least the benchmark concurrency)
+HTTP_POOL_SIZE = 64
+
+# Percentiles of the response time printed after each benchmark
+STATS_PERCENTILES = [50, 95, 99, 100]
+
+# Maximum number of bytes read from an SSH channel at once
+SSH_READ_SIZE = 32768
+
+# File created on the cluster instances (with the exit status of sysbench inside) once sysbench is done
+SYSBENCH_DONE_PATH = "/tmp/sysbench.done"
+# Seconds to wait for sysbench at most (it takes well under a minute, the file is never created if it died)
+SYSBENCH_TIMEOUT = 600
+
+# Poll EC2 every 5s (instead of the default 15s) so that state changes are noticed sooner
+WAITER_CONFIG = {"Delay": 5, "MaxAttempts": 120}
+
+# Dependencies of the manager and worker instances, installed by cloud-init at first boot (see build_user_data)
+CLUSTER_DEPENDENCIES_COMMANDS = [
+    # Update and Install MySQL, sysbench, and Flask
+    "sudo apt-get update",
+    "sudo apt-get install -y mysql-server wget sysbench python3-pip",
+    "sudo pip3 install flask gunicorn msgpack mysql-connector-python orjson requests",
+    # Set MySQL root password
+    'sudo mysql -e \'ALTER USER "root"@"localhost" IDENTIFIED WITH mysql_native_password BY "root_password";\'',
+    # Start and enable MySQL
+    "sudo systemctl start mysql",
+    "sudo systemctl enable mysql",
+    # Download and extract Sakila database
+    "wget https://downloads.mysql.com/docs/sakila-db.tar.gz",
+    "tar -xzvf sakila-db.tar.gz",
+    # Import Sakila schema and data into MySQL, then verify that the Sakila database has been
+    # installed correctly, all through a single mysql session
+    "(cat sakila-db/sakila-schema.sql sakila-db/sakila-data.sql; echo 'SHOW DATABASES; USE sakila; SHOW TABLES;') | sudo mysql -u root -p'root_password'",
+    # Add global environment variables to /etc/environment
+    'echo "MYSQL_USER=root" | sudo tee -a /etc/environment',
+    'echo "MYSQL_PASSWORD=root_password" | sudo tee -a /etc/environment',
+    'echo "MYSQL_DB=sakila" | sudo tee -a /etc/environment',
+    'echo "MYSQL_HOST=localhost" | sudo tee -a /etc/environment',
+    "source /etc/environment",
+]
+
+# Name of the AMI with the cluster dependencies already installed (baked once when IAC_BAKE_AMI=1),
+# versioned by the dependencies so that an AMI baked with older ones is never reused
+CLUSTER_AMI_NAME = "mysql-sakila-ready-" + (
+    hashlib.sha1("\n".join(CLUSTER_DEPENDENCIES_COMMANDS).encode()).hexdigest()[:8]
+)
+
+# Enable GTIDs on a MySQL server, one gtid_mode step at a time (it cannot go from OFF to ON at once).
+# The transactions done before (like the Sakila load) stay anonymous, so the GTID sets all start empty
+ENABLE_GTID_COMMAND = "sudo mysql -u root -p'root_password' -e 'SET PERSIST enforce_gtid_consistency = ON; SET PERSIST gtid_mode = OFF_PERMISSIVE; SET PERSIST gtid_mode = ON_PERMISSIVE; SET PERSIST gtid_mode = ON;'"
+
+# Dependencies of the proxy, trusted host, and gatekeeper instances, installed by cloud-init at first boot
+NETWORK_DEPENDENCIES_COMMANDS = [
+    # Update and Install Python3 and flask
+    "sudo apt-get update",
+    "sudo apt-get install -y python3-pip",
+    "sudo pip3 install flask gunicorn msgpack orjson requests",
+]
+
+# Lock shared by all threads printing to stdout, so that lines from different instances do not interleave
+print_lock = threading.Lock()
+
 
 @dataclass
 class EC2Instance:
     instance: Any
     name: str
+    # Cached once the instance is running (see EC2Manager.wait_until_running)
+    public_ip: str = ""
+    url: str = ""
 
     def get_name(self):
         return f"{self.name}_{self.instance.id}"
 
+    def get_role(self):
+        # All the workers run the same script
+        return "worker" if self.name.startswith("worker") else self.name
+
+
+@dataclass
+class CommandsResult:
+    ec2_instance: EC2Instance
+    exit_status: int
+    error_output: str
+
 
 # Function to create an SSH client
-def create_ssh_client(host, user, key_path):
-    """Create an SSH client using the provided host, user, and key path."""
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(hostname=host, username=user, key_filename=key_path)
-    return ssh
+def create_ssh_client(host, user, key_path, attempts=6):
+    """
+    Create an SSH client using the provided host, user, and key path.
+    Retry with exponential backoff (1s, 2s, 4s, ...), as sshd may not be up yet right after boot.
+    """
+    delay = 1
+    for attempt in range(attempts):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            ssh.connect(hostname=host, username=user, key_filename=key_path)
+            return ssh
+        except (paramiko.SSHException, OSError):
+            ssh.close()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+# Function to get the public IP of this machine
+@functools.lru_cache(maxsize=None)
+def get_public_ip() -> str:
+    """Get the public IP address of the machine running this script (fetched once per process)."""
+    return requests.get("https://checkip.amazonaws.com", timeout=5).text.strip()
+
+
+# Function to build the UserData of an instance
+def build_user_data(commands: list[str]) -> str:
+    """
+    Build the cloud-init script running the commands (as root) at first boot, stopping at the first failure.
+    boto3 takes care of the base64 encoding required by RunInstances.
+    """
+    return "\n".join(
+        [
+            "#!/bin/bash",
+            "set -e",
+            "export DEBIAN_FRONTEND=noninteractive",
+            "cd /tmp",
+        ]
+        + commands
+    )
+
+
+# Function to print from several threads at once
+def safe_print(*args, **kwargs) -> None:
+    """Print while holding the print lock."""
+    with print_lock:
+        print(*args, **kwargs)
+
+
+# Function to print the failed commands
+def print_failures(results: list[CommandsResult | None]) -> None:
+    """Print the exit status and error output of each instance on which the commands failed."""
+    for result in results:
+        if result is not None and result.exit_status != 0:
+            print(
+                f"Commands failed with exit status {result.exit_status} on instance {result.ec2_instance.get_name()}. Error:\n{result.error_output}"
+            )
+
+
+# Function to stop the deployment when a step failed on some of the instances
+def check_failures(results: list[CommandsResult | None], step: str) -> None:
+    """Raise if the commands failed (or raised) on any of the instances (their failures are printed beforehand)."""
+    failures = sum(result is None or result.exit_status != 0 for result in results)
+    if failures:
+        raise RuntimeError(f"{step} failed on {failures} instance(s)")
+
+
+# Function to read the answers saved by a benchmark
+def load_answers(path: str) -> Iterator[dict[str, Any]]:
+    """Yield the answers of a benchmark one by one from its JSON lines file."""
+    with open(path, "r") as file:
+        for line in file:
+            yield json.loads(line)
 
 
 # Function to print stats from benchmark
-def print_stats(answers: list[dict[str, Any]]) -> None:
-    """Print the number of requests and average response time per instance."""
+def print_stats(answers: Iterable[dict[str, Any]]) -> None:
+    """Print the number of requests, and the average and percentiles of the response time, per instance."""
 
-    n_req_per_instance = {"manager": 0, "worker1": 0, "worker2": 0}
-    n_time_per_instance = {"manager": 0, "worker1": 0, "worker2": 0}
+    # Single pass: instance name -> response times
+    times_per_instance = {}
     for answer in answers:
-        if answer["response"]["handled_by"] == "manager":
-            n_req_per_instance["manager"] += 1
-            n_time_per_instance["manager"] += answer["time"]
-        elif answer["response"]["handled_by"] == "worker1":
-            n_req_per_instance["worker1"] += 1
-            n_time_per_instance["worker1"] += answer["time"]
-        elif answer["response"]["handled_by"] == "worker2":
-            n_req_per_instance["worker2"] += 1
-            n_time_per_instance["worker2"] += answer["time"]
-
-    # Divide time per instance by n istance
-    for key in n_time_per_instance:
-        if n_req_per_instance[key] > 0:
-            n_time_per_instance[key] /= n_req_per_instance[key]
-
-    print("Number of requests per instance:")
-    print(n_req_per_instance)
-    print("Average response time per instance:")
-    print(n_time_per_instance)
-
+        times_per_instance.setdefault(answer["response"]["handled_by"], []).append(
+            answer["time"]
+        )
 
-class EC2Manager:
-    def __init__(self) -> None:
-        self.key_name = "temp_key_pair"
+    for times in times_per_instance.values():
+        times.sort()
+
+    # One table: one row per instance, with the number of requests, the average and the percentiles
+    header = ["instance", "requests", "average"] + [
+        f"p{percentile}" for percentile in STATS_PERCENTILES
+    ]
+    print("Response time (s) per instance:")
+    print("".join(f"{column:>12}" for column in header))
+    for key, times in sorted(times_per_instance.items()):
+        row = [sum(times) / len(times)] + [
+            percentile_of(times, percentile) for percentile in STATS_PERCENTILES
+        ]
+        print(
+            f"{key:>12}{len(times):>12}" + "".join(f"{value:>12.4f}" for value in row)
+        )
 
-        # Clients and resources
-        self.ec2_client = boto3.client("ec2", region_name="us-east-1")
-        self.ec2_resource = boto3.resource("ec2", region_name="us-east-1")
 
-        # Ids
-        self.vpc_id = self.ec2_client.describe_vpcs()["Vpcs"][0]["VpcId"]
-        self.ami_id = self._get_latest_ubuntu_ami()
+# Function to get a percentile of sorted values
+def percentile_of(sorted_values: list[float], percentile: float) -> float:
+    """Get the given percentile (nearest-rank method) of a non-empty sorted list."""
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
 
-        # Security groups
-        self.cluster_security_group_id = self.ec2_client.create_security_group(
-            Description="Security group for manager and workers",
-            GroupName="common_sg",
-            VpcId=self.vpc_id,
-        )["GroupId"]
 
-        self.proxy_security_group_id = self.ec2_client.create_security_group(
-            Description="Proxy security group",
-            GroupName="proxy_sg",
-            VpcId=self.vpc_id,
-        )["GroupId"]
+class EC2Manager:
+    # Root volume of every instance
+    BLOCK_DEVICE_MAPPINGS = [
+        {
+            "DeviceName": "/dev/sda1",
+            "Ebs": {
+                "VolumeSize": 16,
+                "VolumeType": "gp3",
+                "DeleteOnTermination": True,
+            },
+        }
+    ]
 
-        self.trusted_host_security_group_id = self.ec2_client.create_security_group(
-            Description="Trusted host security group",
-            GroupName="trusted_host_sg",
-            VpcId=self.vpc_id,
-        )["GroupId"]
+    def __init__(self) -> None:
+        self.key_name = "temp_key_pair"
 
-        self.gatekeeper_security_group_id = self.ec2_client.create_security_group(
-            Description="Gatekeeper security group",
-            GroupName="gatekeeper_sg",
-            VpcId=self.vpc_id,
-        )["GroupId"]
+        # Clients and resources (sharing one session, with client-side rate limiting on throttling)
+        config = Config(
+            region_name="us-east-1",
+            retries={"mode": "adaptive", "max_attempts": 10},
+        )
+        session = boto3.Session()
+        self.ec2_client = session.client("ec2", config=config)
+        self.ec2_resource = session.resource("ec2", config=config)
+
+        # Ids (looked up in prepare)
+        self.vpc_id: str | None = None
+        self.ami_id: str | None = None
+        self.cluster_ami_id: str | None = None
+
+        # Security groups (created or reused in prepare, deleted in cleanup if created)
+        self.created_security_group_ids: list[str] = []
+        self.cluster_security_group_id: str | None = None
+        self.proxy_security_group_id: str | None = None
+        self.trusted_host_security_group_id: str | None = None
+        self.gatekeeper_security_group_id: str | None = None
 
         self.ssh_key_path = os.path.expanduser(f"./{self.key_name}.pem")
 
@@ -101,135 +287,182 @@ class EC2Manager:
         self.proxy_instance: EC2Instance | None = None
         self.gatekeeper_instance: EC2Instance | None = None
         self.trusted_host_instance: EC2Instance | None = None
+        # Every instance launched so far, recorded as soon as its RunInstances call returns, so that cleanup
+        # terminates them even if another launch (or any later step) failed
+        self.launched_instances: list[EC2Instance] = []
+
+        # Opened SSH connections, reused across all the steps (closed in cleanup)
+        self._ssh_pool: dict[tuple[str, str], paramiko.SSHClient] = {}
+        self._ssh_pool_lock = threading.Lock()
+
+        # HTTP session to the gatekeeper, keeping its connections alive across all the requests (closed in cleanup)
+        self._http = requests.Session()
+        self._http.mount(
+            "http://",
+            HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE),
+        )
+
+    def prepare(self) -> None:
+        """
+        Look up the VPC and the AMIs, and get or create the security groups, all at once.
+        """
+        with ThreadPoolExecutor() as executor:
+            # The AMI lookups do not depend on the VPC, overlap them with the rest
+            ami_future = executor.submit(self._get_latest_ubuntu_ami)
+            cluster_ami_future = executor.submit(self._get_cluster_ami)
+
+            self.vpc_id = self.ec2_client.describe_vpcs()["Vpcs"][0]["VpcId"]
+            security_group_specs = [
+                ("common_sg", "Security group for manager and workers"),
+                ("proxy_sg", "Proxy security group"),
+                ("trusted_host_sg", "Trusted host security group"),
+                ("gatekeeper_sg", "Gatekeeper security group"),
+            ]
+            # Created ids are recorded as soon as each group exists, so cleanup deletes them even on partial failure
+            (
+                self.cluster_security_group_id,
+                self.proxy_security_group_id,
+                self.trusted_host_security_group_id,
+                self.gatekeeper_security_group_id,
+            ) = executor.map(
+                lambda spec: self._get_or_create_security_group(*spec),
+                security_group_specs,
+            )
+
+            self.ami_id = ami_future.result()
+            self.cluster_ami_id = cluster_ami_future.result()
+
+    def _get_or_create_security_group(self, group_name: str, description: str) -> str:
+        """
+        Return the ID of the security group with the given name, creating it only if it does not exist yet.
+        """
+        security_groups = self.ec2_client.describe_security_groups(
+            Filters=[
+                {"Name": "group-name", "Values": [group_name]},
+                {"Name": "vpc-id", "Values": [self.vpc_id]},
+            ]
+        )["SecurityGroups"]
+
+        if security_groups:
+            security_group = security_groups[0]
+            # Rules left by a previous run refer to instances that no longer exist (and would be duplicates)
+            if security_group["IpPermissions"]:
+                self.ec2_client.revoke_security_group_ingress(
+                    GroupId=security_group["GroupId"],
+                    IpPermissions=security_group["IpPermissions"],
+                )
+            return security_group["GroupId"]
+
+        group_id = self.ec2_client.create_security_group(
+            Description=description,
+            GroupName=group_name,
+            VpcId=self.vpc_id,
+        )["GroupId"]
+        self.created_security_group_ids.append(group_id)
+        return group_id
 
     def create_key_pair(self) -> None:
-        """Create a new key pair and save the private key to a file."""
+        """
+        Create a new key pair and save the private key to a file, unless both already exist.
+        """
+        try:
+            self.ec2_client.describe_key_pairs(KeyNames=[self.key_name])
+            key_pair_exists = True
+        except ClientError:  # InvalidKeyPair.NotFound
+            key_pair_exists = False
+
+        if key_pair_exists and os.path.exists(self.ssh_key_path):
+            return
+
+        if key_pair_exists:
+            # The private key was lost, so the key pair cannot be used anymore
+            self.ec2_client.delete_key_pair(KeyName=self.key_name)
+
         response = self.ec2_client.create_key_pair(KeyName=self.key_name)
         private_key = response["KeyMaterial"]
-        with open(f"{self.key_name}.pem", "w") as file:
+        with open(self.ssh_key_path, "w") as file:
             file.write(private_key)
+        # The private key is kept across runs, only its owner may read it
+        os.chmod(self.ssh_key_path, 0o600)
 
-    def launch_instances(self) -> list[EC2Instance]:
+    def _launch(
+        self,
+        names: list[str],
+        instance_type: str,
+        security_group_id: str,
+        image_id: str,
+        user_data: str,
+    ) -> list[EC2Instance]:
         """
-        Launch manager, worker, and proxy instances.
-        """
-        # Launch worker instances
-        for i in range(2):
-            self.worker_instances.append(
-                EC2Instance(
-                    self.ec2_resource.create_instances(
-                        ImageId=self.ami_id,
-                        InstanceType="t2.micro",
-                        MinCount=1,
-                        MaxCount=1,
-                        SecurityGroupIds=[self.cluster_security_group_id],
-                        KeyName=self.key_name,
-                        BlockDeviceMappings=[
-                            {
-                                "DeviceName": "/dev/sda1",
-                                "Ebs": {
-                                    "VolumeSize": 16,
-                                    "VolumeType": "gp3",
-                                    "DeleteOnTermination": True,
-                                },
-                            }
-                        ],
-                    )[0],
-                    name=f"worker{i + 1}",
-                )
-            )
-
-        # Launch manager instance
-        self.manager_instance = EC2Instance(
-            self.ec2_resource.create_instances(
-                ImageId=self.ami_id,
-                InstanceType="t2.micro",
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[self.cluster_security_group_id],
-                KeyName=self.key_name,
-                BlockDeviceMappings=[
-                    {
-                        "DeviceName": "/dev/sda1",
-                        "Ebs": {
-                            "VolumeSize": 16,
-                            "VolumeType": "gp3",
-                            "DeleteOnTermination": True,
-                        },
-                    }
-                ],
-            )[0],
-            name="manager",
-        )
-
-        # Launch proxy instance
-        self.proxy_instance = EC2Instance(
-            self.ec2_resource.create_instances(
-                ImageId=self.ami_id,
-                InstanceType="t2.large",
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[self.proxy_security_group_id],
-                KeyName=self.key_name,
-                BlockDeviceMappings=[
-                    {
-                        "DeviceName": "/dev/sda1",
-                        "Ebs": {
-                            "VolumeSize": 16,
-                            "VolumeType": "gp3",
-                            "DeleteOnTermination": True,
-                        },
-                    }
-                ],
-            )[0],
-            name="proxy",
+        Launch one instance per name, all in a single RunInstances call.
+        Goes through the EC2 client, which (unlike the resource) is thread-safe.
+        """
+        response = self.ec2_client.run_instances(
+            ImageId=image_id,
+            InstanceType=instance_type,
+            MinCount=len(names),
+            MaxCount=len(names),
+            SecurityGroupIds=[security_group_id],
+            KeyName=self.key_name,
+            UserData=user_data,
+            BlockDeviceMappings=self.BLOCK_DEVICE_MAPPINGS,
         )
+        assert len(response["Instances"]) == len(names)
+        ec2_instances = [
+            EC2Instance(self.ec2_resource.Instance(instance["InstanceId"]), name=name)
+            for instance, name in zip(response["Instances"], names)
+        ]
+        self.launched_instances.extend(ec2_instances)
+        return ec2_instances
 
-        # Launch trusted host instance
-        self.trusted_host_instance = EC2Instance(
-            self.ec2_resource.create_instances(
-                ImageId=self.ami_id,
-                InstanceType="t2.large",
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[self.trusted_host_security_group_id],
-                KeyName=self.key_name,
-                BlockDeviceMappings=[
-                    {
-                        "DeviceName": "/dev/sda1",
-                        "Ebs": {
-                            "VolumeSize": 16,
-                            "VolumeType": "gp3",
-                            "DeleteOnTermination": True,
-                        },
-                    }
-                ],
-            )[0],
-            name="trusted_host",
-        )
+    def launch_instances(self) -> list[EC2Instance]:
+        """
+        Launch manager, worker, proxy, trusted host, and gatekeeper instances.
+        The RunInstances calls (one per instance type and security group) are sent concurrently.
+        """
+        network_user_data = build_user_data(NETWORK_DEPENDENCIES_COMMANDS)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # Worker and manager instances (same type and security group) in a single call
+            cluster_future = executor.submit(
+                self._launch,
+                ["worker1", "worker2", "manager"],
+                "t2.micro",
+                self.cluster_security_group_id,
+                self.cluster_ami_id or self.ami_id,
+                # Nothing left to install on the baked AMI
+                build_user_data(
+                    [] if self.cluster_ami_id else CLUSTER_DEPENDENCIES_COMMANDS
+                ),
+            )
+            proxy_future = executor.submit(
+                self._launch,
+                ["proxy"],
+                "t2.large",
+                self.proxy_security_group_id,
+                self.ami_id,
+                network_user_data,
+            )
+            trusted_host_future = executor.submit(
+                self._launch,
+                ["trusted_host"],
+                "t2.large",
+                self.trusted_host_security_group_id,
+                self.ami_id,
+                network_user_data,
+            )
+            gatekeeper_future = executor.submit(
+                self._launch,
+                ["gatekeeper"],
+                "t2.large",
+                self.gatekeeper_security_group_id,
+                self.ami_id,
+                network_user_data,
+            )
 
-        # Launch gatekeeper instance
-        self.gatekeeper_instance = EC2Instance(
-            self.ec2_resource.create_instances(
-                ImageId=self.ami_id,
-                InstanceType="t2.large",
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[self.gatekeeper_security_group_id],
-                KeyName=self.key_name,
-                BlockDeviceMappings=[
-                    {
-                        "DeviceName": "/dev/sda1",
-                        "Ebs": {
-                            "VolumeSize": 16,
-                            "VolumeType": "gp3",
-                            "DeleteOnTermination": True,
-                        },
-                    }
-                ],
-            )[0],
-            name="gatekeeper",
-        )
+        *self.worker_instances, self.manager_instance = cluster_future.result()
+        [self.proxy_instance] = proxy_future.result()
+        [self.trusted_host_instance] = trusted_host_future.result()
+        [self.gatekeeper_instance] = gatekeeper_future.result()
 
         return self.worker_instances + [
             self.manager_instance,
@@ -238,169 +471,309 @@ class EC2Manager:
             self.gatekeeper_instance,
         ]
 
+    def wait_until_running(self, all_instances: list[EC2Instance]) -> None:
+        """
+        Wait for all the instances at once, then reload them all (to get their public IPs) with a single describe call.
+        """
+        instances_ids = [ec2_instance.instance.id for ec2_instance in all_instances]
+        waiter = self.ec2_client.get_waiter("instance_running")
+        waiter.wait(InstanceIds=instances_ids, WaiterConfig=WAITER_CONFIG)
+
+        instances_data = {
+            instance_data["InstanceId"]: instance_data
+            for reservation in self.ec2_client.describe_instances(
+                InstanceIds=instances_ids
+            )["Reservations"]
+            for instance_data in reservation["Instances"]
+        }
+        for ec2_instance in all_instances:
+            # Same as instance.reload(), without one DescribeInstances call per instance
+            ec2_instance.instance.meta.data = instances_data[ec2_instance.instance.id]
+            ec2_instance.public_ip = ec2_instance.instance.public_ip_address
+            ec2_instance.url = f"http://{ec2_instance.public_ip}:5000"
+            print(f"Instance {ec2_instance.get_name()} is running.")
+
     def add_inbound_rules(self) -> None:
         """
-        Add inbound rules for security groups
+        Add inbound rules for security groups (one independent AWS call per group, all sent concurrently)
         """
+        ssh_cidr = f"{get_public_ip()}/32"
+        proxy_ip = self.proxy_instance.public_ip
+        trusted_host_ip = self.trusted_host_instance.public_ip
+        gatekeeper_ip = self.gatekeeper_instance.public_ip
+
         # Allow SSH access to all instances
-        self.ec2_client.authorize_security_group_ingress(
-            GroupId=self.cluster_security_group_id,
-            IpPermissions=[
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 22,
-                    "ToPort": 22,
-                    "IpRanges": [
-                        {
-                            "CidrIp": "0.0.0.0/0",  # Allow SSH access from anywhere
-                        },
-                    ],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 5000,
-                    "ToPort": 5000,
-                    "IpRanges": [  # Allow access from the proxy, and from the manager (for the workers)
-                        {
-                            "CidrIp": f"{self.manager_instance.instance.public_ip_address}/32"
-                        },
-                        {
-                            "CidrIp": f"{self.proxy_instance.instance.public_ip_address}/32"
-                        },
-                    ],
-                },
-            ],
-        )
-        self.ec2_client.authorize_security_group_ingress(
-            GroupId=self.proxy_security_group_id,
-            IpPermissions=[
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 22,
-                    "ToPort": 22,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 5000,
-                    "ToPort": 5000,
-                    "IpRanges": [
-                        {
-                            "CidrIp": f"{self.trusted_host_instance.instance.public_ip_address}/32"  # Allow access from the trusted host
-                        }
-                    ],
-                },
-            ],
-        )
-        self.ec2_client.authorize_security_group_ingress(
-            GroupId=self.trusted_host_security_group_id,
-            IpPermissions=[
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 22,
-                    "ToPort": 22,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 5000,
-                    "ToPort": 5000,
-                    "IpRanges": [
-                        {
-                            "CidrIp": f"{self.gatekeeper_instance.instance.public_ip_address}/32"  # Allow access from the gatekeeper
-                        }
-                    ],
-                },
-            ],
-        )
-        self.ec2_client.authorize_security_group_ingress(
-            GroupId=self.gatekeeper_security_group_id,
-            IpPermissions=[
+        ssh_permission = {
+            "IpProtocol": "tcp",
+            "FromPort": 22,
+            "ToPort": 22,
+            "IpRanges": [
                 {
-                    "IpProtocol": "tcp",
-                    "FromPort": 22,
-                    "ToPort": 22,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 5000,
-                    "ToPort": 5000,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],  # Allow access from anywhere
+                    "CidrIp": ssh_cidr,  # Allow SSH access from this machine only
                 },
             ],
-        )
+        }
+        rules = [
+            (
+                self.cluster_security_group_id,
+                [
+                    ssh_permission,
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 5000,
+                        "ToPort": 5000,
+                        "IpRanges": [  # Allow access from the proxy
+                            {"CidrIp": f"{proxy_ip}/32"},
+                        ],
+                    },
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 3306,
+                        "ToPort": 3306,
+                        "UserIdGroupPairs": [  # Allow MySQL replication within the cluster
+                            {"GroupId": self.cluster_security_group_id},
+                        ],
+                    },
+                ],
+            ),
+            (
+                self.proxy_security_group_id,
+                [
+                    ssh_permission,
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 5000,
+                        "ToPort": 5000,
+                        "IpRanges": [
+                            {
+                                "CidrIp": f"{trusted_host_ip}/32"  # Allow access from the trusted host
+                            }
+                        ],
+                    },
+                ],
+            ),
+            (
+                self.trusted_host_security_group_id,
+                [
+                    ssh_permission,
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 5000,
+                        "ToPort": 5000,
+                        "IpRanges": [
+                            {
+                                "CidrIp": f"{gatekeeper_ip}/32"  # Allow access from the gatekeeper
+                            }
+                        ],
+                    },
+                ],
+            ),
+            (
+                self.gatekeeper_security_group_id,
+                [
+                    ssh_permission,
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 5000,
+                        "ToPort": 5000,
+                        "IpRanges": [
+                            {"CidrIp": "0.0.0.0/0"}
+                        ],  # Allow access from anywhere
+                    },
+                ],
+            ),
+        ]
+
+        with ThreadPoolExecutor(max_workers=len(rules)) as executor:
+            futures = [
+                executor.submit(
+                    self.ec2_client.authorize_security_group_ingress,
+                    GroupId=group_id,
+                    IpPermissions=ip_permissions,
+                )
+                for group_id, ip_permissions in rules
+            ]
+            for future in futures:
+                future.result()  # Raise the first error, if any
+
+    def _get_ssh(self, host: str, user: str) -> paramiko.SSHClient:
+        """
+        Return the pooled SSH client for (host, user), connecting only if there is no active one yet.
+        """
+        with self._ssh_pool_lock:
+            ssh_client = self._ssh_pool.get((host, user))
+        if ssh_client is not None:
+            transport = ssh_client.get_transport()
+            if transport is not None and transport.is_active():
+                return ssh_client
+            ssh_client.close()
+
+        # Connect outside of the lock, so that connections to different hosts are opened concurrently
+        ssh_client = create_ssh_client(host, user, self.ssh_key_path)
+        # Keep the connection alive between steps, so that it is not dropped while idle (e.g. during sysbench)
+        ssh_client.get_transport().set_keepalive(30)
+        with self._ssh_pool_lock:
+            self._ssh_pool[(host, user)] = ssh_client
+        return ssh_client
+
+    def close_ssh_connections(self) -> None:
+        """Close all the pooled SSH connections."""
+        with self._ssh_pool_lock:
+            for ssh_client in self._ssh_pool.values():
+                ssh_client.close()
+            self._ssh_pool.clear()
+
+    def run_in_parallel(
+        self,
+        function: Callable[..., Any],
+        instances: list[EC2Instance],
+        *args: Any,
+    ) -> list[Any]:
+        """
+        Call `function(ec2_instance, *args)` for each instance provided, each one in its own thread.
+        Return the results in the order of the instances (None for a call that raised).
+        """
+        if not instances:
+            return []
+
+        results = [None] * len(instances)
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            futures = {
+                executor.submit(function, ec2_instance, *args): index
+                for index, ec2_instance in enumerate(instances)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    safe_print(
+                        f"An error occurred on instance {instances[index].get_name()}: {e}"
+                    )
+        return results
 
     def execute_commands(
         self,
         commands: list[str],
         instances: list[EC2Instance],
         print_output: bool = True,
-    ) -> None:
+    ) -> list[CommandsResult | None]:
         """
-        This function executes a list of commands on each instance provided.
+        This function executes a list of commands on each instance provided, in parallel.
+        Failures are reported once all instances are done, instead of interleaved with the output.
         """
-        try:
-            for ec2_instance in instances:
-                # Connect to the instance
-                ssh_client = create_ssh_client(
-                    ec2_instance.instance.public_ip_address, "ubuntu", self.ssh_key_path
-                )
-
-                # Run the commands
-                for command in commands:
-                    print(
-                        f"Executing command: {command} on instance {ec2_instance.get_name()}"
-                    )
-                    stdin, stdout, stderr = ssh_client.exec_command(command)
-
-                    # Process output in real-time
-                    for line in iter(stdout.readline, ""):
-                        if print_output:
-                            print(line, end="")  # Print each line from stdout
-                    error_output = stderr.read().decode()  # Capture any error output
-
-                    # Wait for command to complete
-                    exit_status = stdout.channel.recv_exit_status()
-                    if exit_status != 0:
-                        print(
-                            f"Command '{command}' failed with exit status {exit_status}. Error:\n{error_output}"
-                        )
-                ssh_client.close()
-                time.sleep(2)
+        results = self.run_in_parallel(
+            self._run_on_instance, instances, commands, print_output
+        )
+        print_failures(results)
+        return results
 
-        except Exception as e:
-            print(f"An error occurred: {e}")
+    def _run_on_instance(
+        self,
+        ec2_instance: EC2Instance,
+        commands: list[str],
+        print_output: bool,
+    ) -> CommandsResult:
+        """
+        Execute a list of commands, one after the other, in a single shell session on a single instance.
+        """
+        # Connect to the instance (or reuse the already opened connection)
+        ssh_client = self._get_ssh(ec2_instance.public_ip, "ubuntu")
+
+        # Run all the commands in a single shell session (one channel), stopping at the first failure.
+        # A command whose failure must not abort the others should end with `|| true`.
+        # The braces make bash read the whole script before running it, so that a command
+        # reading its stdin (e.g. apt-get) cannot swallow the commands that follow it.
+        script = "\n".join(
+            ["{", "set -e", "trap 'echo \"Command failed: $BASH_COMMAND\" >&2' ERR"]
+            + commands
+            + ["}"]
+        )
+        safe_print(
+            f"Executing {len(commands)} commands on instance {ec2_instance.get_name()}"
+        )
+        stdin, stdout, stderr = ssh_client.exec_command("bash -s")
+        stdin.write(script + "\n")
+        stdin.channel.shutdown_write()
+
+        # Drain stdout and stderr concurrently, so that a command filling the stderr pipe
+        # cannot stall while we are still reading stdout (and the other way around)
+        channel = stdout.channel
+        pending_output = b""
+        error_chunks = []
+        while True:
+            select.select([channel], [], [], 0.1)
+            while channel.recv_ready():
+                data = channel.recv(SSH_READ_SIZE)
+                if print_output:
+                    # Print the complete lines in real-time, keep the last partial one
+                    *lines, pending_output = (pending_output + data).split(b"\n")
+                    for line in lines:
+                        safe_print(line.decode(errors="replace"))
+            while channel.recv_stderr_ready():
+                error_chunks.append(channel.recv_stderr(SSH_READ_SIZE))
+            if (
+                channel.exit_status_ready()
+                and not channel.recv_ready()
+                and not channel.recv_stderr_ready()
+            ):
+                break
+        if pending_output:
+            safe_print(pending_output.decode(errors="replace"))
+        error_output = b"".join(error_chunks).decode(errors="replace")
+
+        # Get the exit status of the commands
+        exit_status = channel.recv_exit_status()
+        return CommandsResult(ec2_instance, exit_status, error_output)
+
+    def wait_until_dependencies_installed(
+        self, all_instances: list[EC2Instance]
+    ) -> None:
+        """
+        Wait, on all instances at once, for cloud-init to finish installing the dependencies given as user data.
+        Raise if the installation failed on any instance.
+        """
+        results = self.execute_commands(
+            ["cloud-init status --wait"],
+            all_instances,
+            print_output=False,
+        )
+        check_failures(results, "Installing the dependencies")
 
-    def install_cluster_dependencies(self) -> None:
-        """Install common dependencies on the manager and worker instances."""
+    def bake_cluster_ami(self) -> None:
+        """
+        Create an AMI from the manager, once its dependencies are installed, so that the next runs can skip the installation.
+        The image is kept after cleanup.
+        """
+        if self.cluster_ami_id:
+            return
+
+        # No reboot, so that the manager stays available; the snapshot goes on in the background
+        image_id = self.ec2_client.create_image(
+            InstanceId=self.manager_instance.instance.id,
+            Name=CLUSTER_AMI_NAME,
+            NoReboot=True,
+        )["ImageId"]
+        print(f"Creation of AMI {image_id} ({CLUSTER_AMI_NAME}) initiated.")
+
+    def start_sys_bench(self) -> None:
+        """
+        Start sysbench (prepare, then run) in the background on the manager and worker instances,
+        so that other steps can go on meanwhile (see wait_for_sys_bench).
+        """
+        sysbench_script = " && ".join(
+            [
+                "sudo sysbench /usr/share/sysbench/oltp_read_only.lua --mysql-db=sakila --mysql-user='root' --mysql-password='root_password' prepare",
+                "sudo sysbench /usr/share/sysbench/oltp_read_only.lua --mysql-db=sakila --mysql-user='root' --mysql-password='root_password' run > sysbench_results.txt",
+            ]
+        )
+        # The exit status is written to the sentinel file once sysbench is done (renamed into
+        # place, so that it is never seen empty)
+        sysbench_script += f"; echo $? > {SYSBENCH_DONE_PATH}.tmp && mv {SYSBENCH_DONE_PATH}.tmp {SYSBENCH_DONE_PATH}"
         commands = [
-            # Update and Install MySQL, sysbench, and Flask
-            "sudo apt-get update",
-            "sudo apt-get install -y mysql-server wget sysbench python3-pip",
-            "sudo pip3 install flask mysql-connector-python requests",
-            # Set MySQL root password
-            'sudo mysql -e \'ALTER USER "root"@"localhost" IDENTIFIED WITH mysql_native_password BY "root_password";\'',
-            # Start and enable MySQL
-            "sudo systemctl start mysql",
-            "sudo systemctl enable mysql",
-            # Download and extract Sakila database
-            "wget https://downloads.mysql.com/docs/sakila-db.tar.gz",
-            "tar -xzvf sakila-db.tar.gz",
-            # Import Sakila schema and data into MySQL
-            "sudo mysql -u root -p'root_password' -e 'SOURCE sakila-db/sakila-schema.sql;'",
-            "sudo mysql -u root -p'root_password' -e 'SOURCE sakila-db/sakila-data.sql;'",
-            # Verify that the Sakila database has been installed correctly
-            "sudo mysql -u root -p'root_password' -e 'SHOW DATABASES;'",
-            "sudo mysql -u root -p'root_password' -e 'USE sakila; SHOW TABLES;'",
-            # Add global environment variables to /etc/environment
-            'echo "MYSQL_USER=root" | sudo tee -a /etc/environment',
-            'echo "MYSQL_PASSWORD=root_password" | sudo tee -a /etc/environment',
-            'echo "MYSQL_DB=sakila" | sudo tee -a /etc/environment',
-            'echo "MYSQL_HOST=localhost" | sudo tee -a /etc/environment',
-            "source /etc/environment",
+            f"rm -f {SYSBENCH_DONE_PATH} {SYSBENCH_DONE_PATH}.tmp",
+            f"nohup bash -c {shlex.quote(sysbench_script)} > sysbench_output.log 2>&1 &",
         ]
-
         # Execute commands
         self.execute_commands(
             commands,
@@ -408,271 +781,295 @@ class EC2Manager:
             print_output=False,
         )
 
-    def install_network_instances_dependencies(self) -> None:
-        """Install common dependencies on the proxy, trusted host, and gatekeeper instances."""
+    def wait_for_sys_bench(self) -> None:
+        """
+        Wait for sysbench to be done on the manager and worker instances.
+        Raise if it failed, or is still not done after SYSBENCH_TIMEOUT seconds, on any instance.
+        """
+        wait_script = f"while [ ! -f {SYSBENCH_DONE_PATH} ]; do sleep 1; done"
         commands = [
-            # Update and Install Python3 and flask
-            "sudo apt-get update",
-            "sudo apt-get install -y python3-pip",
-            "sudo pip3 install flask requests",
+            f"timeout {SYSBENCH_TIMEOUT} bash -c {shlex.quote(wait_script)}",
+            f"exit $(cat {SYSBENCH_DONE_PATH})",
         ]
-
-        # Execute commands
-        self.execute_commands(
+        results = self.execute_commands(
             commands,
-            [self.proxy_instance, self.trusted_host_instance, self.gatekeeper_instance],
+            [self.manager_instance] + self.worker_instances,
             print_output=False,
         )
+        check_failures(results, "Sysbench")
 
-    def run_sys_bench(self) -> None:
-        """Run sysbench on the manager and worker instances."""
-        sysbench_commands = [
-            "sudo sysbench /usr/share/sysbench/oltp_read_only.lua --mysql-db=sakila --mysql-user='root' --mysql-password='root_password' prepare",
-            "sudo sysbench /usr/share/sysbench/oltp_read_only.lua --mysql-db=sakila --mysql-user='root' --mysql-password='root_password' run > sysbench_results.txt",
+    def setup_replication(self) -> None:
+        """
+        Make the MySQL servers of the workers replicate (with GTIDs) every write done on the manager MySQL server,
+        and make them read-only. Raise if this failed on any instance.
+        """
+        commands = [
+            # Let the workers connect to the manager MySQL server
+            "sudo sed -i 's/^bind-address.*/bind-address = 0.0.0.0/' /etc/mysql/mysql.conf.d/mysqld.cnf",
+            "sudo systemctl restart mysql",
+            "sudo mysql -u root -p'root_password' -e \"CREATE USER IF NOT EXISTS 'replica'@'%' IDENTIFIED WITH mysql_native_password BY 'replica_password'; GRANT REPLICATION SLAVE, REPLICATION CLIENT ON *.* TO 'replica'@'%';\"",
+            ENABLE_GTID_COMMAND,
+            # The older binary logs only hold the anonymous transactions of the Sakila load (also done by each
+            # worker), which a replica using GTID auto-positioning would refuse
+            "sudo mysql -u root -p'root_password' -e 'FLUSH BINARY LOGS; PURGE BINARY LOGS BEFORE NOW();'",
         ]
-        # Execute commands
-        self.execute_commands(
-            sysbench_commands,
-            [self.manager_instance] + self.worker_instances,
-            print_output=False,
+        check_failures(
+            self.execute_commands(
+                commands, [self.manager_instance], print_output=False
+            ),
+            "Replication setup on the manager",
         )
 
+        results = self.run_in_parallel(
+            self._setup_worker_replication, self.worker_instances
+        )
+        print_failures(results)
+        check_failures(results, "Replication setup on the workers")
+
+    def _setup_worker_replication(self, ec2_instance: EC2Instance) -> CommandsResult:
+        """Start replicating the manager MySQL server on a single worker, from the GTIDs it has not executed yet."""
+        # The manager has server_id 1, each worker needs its own
+        server_id = 2 + self.worker_instances.index(ec2_instance)
+        manager_ip = self.manager_instance.instance.private_ip_address
+        commands = [
+            # A fresh server UUID (the instance may come from an AMI baked from the manager)
+            "sudo rm -f /var/lib/mysql/auto.cnf",
+            "sudo systemctl restart mysql",
+            f"sudo mysql -u root -p'root_password' -e 'SET PERSIST server_id = {server_id};'",
+            ENABLE_GTID_COMMAND,
+            # Only the replication threads may write (super_read_only also applies to root)
+            f"sudo mysql -u root -p'root_password' -e \"CHANGE MASTER TO MASTER_HOST='{manager_ip}', MASTER_USER='replica', MASTER_PASSWORD='replica_password', MASTER_AUTO_POSITION=1; SET PERSIST super_read_only = ON; START SLAVE;\"",
+        ]
+        return self._run_on_instance(ec2_instance, commands, print_output=False)
+
     def save_sys_bench_results(self) -> None:
         """Download the sysbench results from the manager and worker instances."""
-        try:
-            for ec2_instance in [self.manager_instance] + self.worker_instances:
-                # Connect to the instance
-                ssh_client = create_ssh_client(
-                    ec2_instance.instance.public_ip_address, "ubuntu", self.ssh_key_path
-                )
-
-                # Download the sysbench results
-                scp = SCPClient(ssh_client.get_transport())
-                scp.get(
-                    "sysbench_results.txt",
-                    f"data/sysbench_results_{ec2_instance.get_name()}.txt",
-                )
-                print(
-                    f"Sysbench results downloaded to data/sysbench_results_{ec2_instance.get_name()}.txt"
-                )
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
+        self.run_in_parallel(
+            self._download_sys_bench_results,
+            [self.manager_instance] + self.worker_instances,
+        )
 
-        finally:
-            scp.close()
-            ssh_client.close()
+    def _download_sys_bench_results(self, ec2_instance: EC2Instance) -> None:
+        """Download the sysbench results from a single instance."""
+        # Connect to the instance (or reuse the already opened connection)
+        ssh_client = self._get_ssh(ec2_instance.public_ip, "ubuntu")
+        sftp = ssh_client.open_sftp()
 
-    def upload_flask_apps_to_instances(self) -> None:
-        """Upload the corresponding script (of a Flask server) to each instance."""
         try:
-            # Upload the Flask app to the manager instance
-            ssh_client = create_ssh_client(
-                self.manager_instance.instance.public_ip_address,
-                "ubuntu",
-                self.ssh_key_path,
+            # Download the sysbench results
+            sftp.get(
+                "sysbench_results.txt",
+                f"data/sysbench_results_{ec2_instance.get_name()}.txt",
             )
-            scp = SCPClient(ssh_client.get_transport())
-            scp.put("scripts/manager_script.py", "manager_script.py")
-            scp.put("public_ips.json", "public_ips.json")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-        finally:
-            scp.close()
-            ssh_client.close()
-
-        # Upload worker script to worker instances
-        for worker in self.worker_instances:
-            try:
-                ssh_client = create_ssh_client(
-                    worker.instance.public_ip_address, "ubuntu", self.ssh_key_path
-                )
-                scp = SCPClient(ssh_client.get_transport())
-                scp.put("scripts/worker_script.py", "worker_script.py")
-            except Exception as e:
-                print(
-                    f"Error uploading and starting worker script on {worker.get_name()}: {e}"
-                )
-            finally:
-                scp.close()
-                ssh_client.close()
-
-        # Upload proxy script to proxy instance
-        try:
-            ssh_client = create_ssh_client(
-                self.proxy_instance.instance.public_ip_address,
-                "ubuntu",
-                self.ssh_key_path,
+            safe_print(
+                f"Sysbench results downloaded to data/sysbench_results_{ec2_instance.get_name()}.txt"
             )
-            scp = SCPClient(ssh_client.get_transport())
-            scp.put("scripts/proxy_script.py", "proxy_script.py")
-            scp.put("public_ips.json", "public_ips.json")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
 
         finally:
-            scp.close()
-            ssh_client.close()
+            sftp.close()
 
-        # Upload trusted host script to trusted host instance
-        try:
-            ssh_client = create_ssh_client(
-                self.trusted_host_instance.instance.public_ip_address,
-                "ubuntu",
-                self.ssh_key_path,
-            )
-            scp = SCPClient(ssh_client.get_transport())
-            scp.put("scripts/trusted_host_script.py", "trusted_host_script.py")
-            scp.put("public_ips.json", "public_ips.json")
+    def upload_flask_apps_to_instances(self) -> None:
+        """Upload the corresponding script (of a Flask server) to each instance."""
+        self.run_in_parallel(
+            self._upload_flask_app,
+            [self.manager_instance]
+            + self.worker_instances
+            + [
+                self.proxy_instance,
+                self.trusted_host_instance,
+                self.gatekeeper_instance,
+            ],
+        )
 
-        except Exception as e:
-            print(f"An error occurred: {e}")
+    def _upload_flask_app(self, ec2_instance: EC2Instance) -> None:
+        """
+        Upload the Flask script matching the role of the instance, with the helper modules it imports
+        (and the public IPs, except for the manager and the workers).
+        """
+        role = ec2_instance.get_role()
 
-        finally:
-            scp.close()
-            ssh_client.close()
+        ssh_client = self._get_ssh(ec2_instance.public_ip, "ubuntu")
+        sftp = ssh_client.open_sftp()
 
-        # Upload gatekeeper script to gatekeeper instance
         try:
-            ssh_client = create_ssh_client(
-                self.gatekeeper_instance.instance.public_ip_address,
-                "ubuntu",
-                self.ssh_key_path,
-            )
-            scp = SCPClient(ssh_client.get_transport())
-            scp.put("scripts/gatekeeper_script.py", "gatekeeper_script.py")
-            scp.put("public_ips.json", "public_ips.json")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            sftp.put(f"scripts/{role}_script.py", f"{role}_script.py")
+            sftp.put("scripts/json_provider.py", "json_provider.py")
+            # The manager and the workers share their database helpers, and do not contact any other instance
+            if role in ["manager", "worker"]:
+                sftp.put("scripts/db_common.py", "db_common.py")
+            else:
+                sftp.put("public_ips.json", "public_ips.json")
 
         finally:
-            scp.close()
-            ssh_client.close()
-
-    def start_db_cluster_apps(self) -> None:
-        """Start the Flask app on the manager and workers instances."""
-        commands = [
-            "nohup python3 manager_script.py > manager_output.log 2>&1 &",
-        ]
-        self.execute_commands(commands, [self.manager_instance])
-
-        commands = [
-            "nohup python3 worker_script.py > worker_output.log 2>&1 &",
-        ]
-        self.execute_commands(commands, self.worker_instances)
-
-    def start_proxy_app(self) -> None:
-        """Start the Flask app on the proxy instance."""
-        commands = [
-            "nohup python3 proxy_script.py > proxy_output.log 2>&1 &",
-        ]
-        self.execute_commands(commands, [self.proxy_instance])
+            sftp.close()
+
+    def start_flask_apps(self) -> None:
+        """Start the Flask app on every instance, all instances at once."""
+        results = self.run_in_parallel(
+            self._start_flask_app,
+            [self.manager_instance]
+            + self.worker_instances
+            + [
+                self.proxy_instance,
+                self.trusted_host_instance,
+                self.gatekeeper_instance,
+            ],
+        )
+        print_failures(results)
 
-    def start_trusted_host_app(self) -> None:
-        """Start the Flask app on the trusted host instance."""
+    def _start_flask_app(self, ec2_instance: EC2Instance) -> CommandsResult:
+        """Start the Flask app matching the role of the instance, in the background."""
+        role = ec2_instance.get_role()
+        # A single process (the proxy keeps the mode in memory), with one thread per in-flight request
+        # (as many threads as the pooled database connections of the manager and workers)
         commands = [
-            "nohup python3 trusted_host_script.py > trusted_host_output.log 2>&1 &",
+            f"nohup gunicorn --worker-class gthread --workers 1 --threads 32 --bind 0.0.0.0:5000 {role}_script:app > {role}_output.log 2>&1 &",
         ]
-        self.execute_commands(commands, [self.trusted_host_instance])
+        return self._run_on_instance(ec2_instance, commands, print_output=True)
 
-    def start_gatekeeper_app(self) -> None:
-        """Start the Flask app on the gatekeeper instance."""
-        commands = [
-            "nohup python3 gatekeeper_script.py > gatekeeper_output.log 2>&1 &",
-        ]
-        self.execute_commands(commands, [self.gatekeeper_instance])
+    def wait_until_apps_ready(self, timeout: float = 60) -> None:
+        """
+        Poll the mode through the gatekeeper until it answers, which means that
+        the gatekeeper, trusted host and proxy Flask apps are all up.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                response = self._http.get(
+                    f"{self.gatekeeper_instance.url}/mode",
+                    timeout=2,
+                )
+                if response.status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                print("Flask apps are still not answering, benchmarking anyway.")
+                return
+            time.sleep(0.5)
 
     def set_mode(self, mode: str) -> None:
         # Set the mode on the proxy instance
-        response = requests.post(
-            f"http://{self.gatekeeper_instance.instance.public_ip_address}:5000/mode",
+        response = self._http.post(
+            f"{self.gatekeeper_instance.url}/mode",
             json={"mode": mode},
         )
         print(response.json())
 
-    def benchmark(self) -> dict[str, Any]:
-        answers = []
-        # 1000 write queries
-        for i in range(1000):
-            initial_time = time.time()
-            response = requests.post(
-                f"http://{self.gatekeeper_instance.instance.public_ip_address}:5000/query",
-                json={
-                    "query": "INSERT INTO actor (first_name, last_name) VALUES ('John', 'Doe')"
-                },
-            )
-            answers.append(
-                {
-                    "time": time.time() - initial_time,
-                    "response": response.json(),
-                }
-            )
-
-        # 1000 read queries
-        for i in range(1000):
-            initial_time = time.time()
-            response = requests.post(
-                f"http://{self.gatekeeper_instance.instance.public_ip_address}:5000/query",
-                json={"query": "SELECT COUNT(*) AS total_entries FROM actor;"},
-            )
-            answers.append(
-                {
-                    "time": time.time() - initial_time,
-                    "response": response.json(),
-                }
-            )
-
-        return answers
+    def benchmark(
+        self, out_path: str, concurrency: int = BENCHMARK_CONCURRENCY
+    ) -> None:
+        """
+        Send 1000 write queries, then 1000 read queries, to the gatekeeper,
+        with `concurrency` requests in flight at once (over kept-alive connections).
+        Each answer is written to `out_path` as one JSON line as soon as it arrives.
+        """
+        url = f"{self.gatekeeper_instance.url}/query"
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            with open(out_path, "w", buffering=1 << 20) as file:
+                for query in [BENCHMARK_WRITE_QUERY, BENCHMARK_READ_QUERY]:
+                    # The payload is the same for all the requests, encode it only once
+                    body = json.dumps({"query": query}).encode()
+                    for answer in executor.map(
+                        self._send_query,
+                        repeat(url),
+                        repeat(body, BENCHMARK_N_QUERIES),
+                    ):
+                        file.write(json.dumps(answer) + "\n")
+
+    def _send_query(self, url: str, body: bytes) -> dict[str, Any]:
+        """Send a single already encoded query and measure its response time."""
+        initial_time = time.perf_counter()
+        response = self._http.post(url, data=body, headers=JSON_HEADERS)
+        return {
+            "time": time.perf_counter() - initial_time,
+            "response": response.json(),
+        }
 
     def cleanup(self, all_instances: list[EC2Instance]) -> None:
         """
-        Delete the target groups, terminate all instances and delete the security groups.
+        Terminate all instances, then delete the security groups and key pair created by this run.
 
         """
+        self.close_ssh_connections()
+        self._http.close()
+
         try:
-            # Terminate EC2 instance
+            # Terminate EC2 instance (there are none if the run failed before launching them)
             instances_ids = [ec2_instance.instance.id for ec2_instance in all_instances]
-            self.ec2_client.terminate_instances(InstanceIds=instances_ids)
-            print(f"Termination of instances {instances_ids} initiated.")
-
-            waiter = self.ec2_client.get_waiter("instance_terminated")
-            waiter.wait(InstanceIds=instances_ids)
-            print("Instances terminated.")
-
-            # Delete security groups
-            self.ec2_client.delete_security_group(
-                GroupId=self.cluster_security_group_id
-            )
-            print(f"Security group {self.cluster_security_group_id} deleted.")
-
-            self.ec2_client.delete_security_group(GroupId=self.proxy_security_group_id)
-            print(f"Security group {self.proxy_security_group_id} deleted.")
-
-            self.ec2_client.delete_security_group(
-                GroupId=self.trusted_host_security_group_id
-            )
-            print(f"Security group {self.trusted_host_security_group_id} deleted.")
-
-            self.ec2_client.delete_security_group(
-                GroupId=self.gatekeeper_security_group_id
-            )
-            print(f"Security group {self.gatekeeper_security_group_id} deleted.")
+            if instances_ids:
+                self.ec2_client.terminate_instances(InstanceIds=instances_ids)
+                print(f"Termination of instances {instances_ids} initiated.")
+
+                waiter = self.ec2_client.get_waiter("instance_terminated")
+                waiter.wait(InstanceIds=instances_ids, WaiterConfig=WAITER_CONFIG)
+                print("Instances terminated.")
+
+            # Delete the security groups created by this run, all at once
+            if self.created_security_group_ids:
+                with ThreadPoolExecutor(
+                    max_workers=len(self.created_security_group_ids)
+                ) as executor:
+                    list(
+                        executor.map(
+                            self._delete_security_group, self.created_security_group_ids
+                        )
+                    )
 
-            # Delete key pair
-            self.ec2_client.delete_key_pair(KeyName=self.key_name)
-            os.remove(self.ssh_key_path)
+            # Delete key pair (only if asked to, it is reused by the next runs otherwise)
+            if EPHEMERAL_KEY_PAIR:
+                self.ec2_client.delete_key_pair(KeyName=self.key_name)
+                if os.path.exists(self.ssh_key_path):
+                    os.remove(self.ssh_key_path)
 
         except ClientError as e:
             print(f"An error occurred: {e}")
 
+    def _delete_security_group(self, security_group_id: str, attempts: int = 6) -> None:
+        """
+        Delete a security group, retrying with exponential backoff while the network interfaces
+        of the terminated instances still reference it (DependencyViolation).
+        """
+        delay = 1
+        for attempt in range(attempts):
+            try:
+                self.ec2_client.delete_security_group(GroupId=security_group_id)
+                safe_print(f"Security group {security_group_id} deleted.")
+                return
+            except ClientError as e:
+                if (
+                    e.response["Error"]["Code"] != "DependencyViolation"
+                    or attempt == attempts - 1
+                ):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def _get_cluster_ami(self) -> str | None:
+        """
+        Get the ID of the AMI baked by a previous run (see bake_cluster_ami), if there is one.
+        """
+        images = self.ec2_client.describe_images(
+            Filters=[
+                {"Name": "name", "Values": [CLUSTER_AMI_NAME]},
+                {"Name": "state", "Values": ["available"]},
+            ],
+            Owners=["self"],
+        )["Images"]
+        return images[0]["ImageId"] if images else None
+
     def _get_latest_ubuntu_ami(self) -> str:
         """
-        Get the latest Ubuntu AMI ID.
+        Get the latest Ubuntu AMI ID, from the on-disk cache if it is less than a day old.
         """
+        try:
+            with open(AMI_CACHE_PATH, "r") as file:
+                cache = json.load(file)
+            if time.time() - cache["timestamp"] < AMI_CACHE_TTL:
+                return cache["ami_id"]
+        except (OSError, ValueError, KeyError):
+            pass  # No usable cache, query EC2
+
         response = self.ec2_client.describe_images(
             Filters=[
                 {
@@ -683,102 +1080,92 @@ class EC2Manager:
                 },
                 {"Name": "virtualization-type", "Values": ["hvm"]},
                 {"Name": "architecture", "Values": ["x86_64"]},
+                {"Name": "state", "Values": ["available"]},
+                {"Name": "root-device-type", "Values": ["ebs"]},
             ],
             Owners=["099720109477"],  # Canonical
         )
-        images = response["Images"]
-        images.sort(key=lambda x: x["CreationDate"], reverse=True)
-        return images[0]["ImageId"]
+        # Single pass over the images instead of sorting all of them
+        ami_id = max(response["Images"], key=itemgetter("CreationDate"))["ImageId"]
 
+        os.makedirs(os.path.dirname(AMI_CACHE_PATH), exist_ok=True)
+        with open(AMI_CACHE_PATH, "w") as file:
+            json.dump({"ami_id": ami_id, "timestamp": time.time()}, file)
 
-# Main
-
-ec2_manager = EC2Manager()
+        return ami_id
 
-# Clear data folder
-os.system("rm -rf data")
-os.system("mkdir data")
 
-ec2_manager.create_key_pair()
-time.sleep(5)
-print("Launching instances...")
-all_instances = ec2_manager.launch_instances()
-
-# Wait for instances to be running
-print("Waiting for instances to be running...")
-for ec2_instance in all_instances:
-    ec2_instance.instance.wait_until_running()
-    ec2_instance.instance.reload()
-    print(f"Instance {ec2_instance.get_name()} is running.")
-
-print("All instances are running.")
-time.sleep(10)
+# Main
 
-ec2_manager.add_inbound_rules()
+ec2_manager = EC2Manager()
 
-# Save public ips to a JSON file
-instance_data = {}
-for ec2_instance in all_instances:
-    instance_data[ec2_instance.name] = ec2_instance.instance.public_ip_address
+# Whatever step fails, the resources created so far are released (instances are billed until terminated)
+try:
+    ec2_manager.prepare()
 
-with open("public_ips.json", "w") as file:
-    json.dump(instance_data, file, indent=4)
+    # Clear data folder
+    shutil.rmtree("data", ignore_errors=True)
+    os.makedirs("data", exist_ok=True)
 
-print("Installing cluster dependencies...")
-ec2_manager.install_cluster_dependencies()
+    ec2_manager.create_key_pair()
+    print("Launching instances...")
+    all_instances = ec2_manager.launch_instances()
 
-print("Installing proxy, trusted host and gatekeeper dependencies...")
-ec2_manager.install_network_instances_dependencies()
+    # Wait for instances to be running
+    print("Waiting for instances to be running...")
+    ec2_manager.wait_until_running(all_instances)
+    print("All instances are running.")
 
-print("Running sysbench...")
-ec2_manager.run_sys_bench()
+    ec2_manager.add_inbound_rules()
 
-print("Saving sysbench results...")
-ec2_manager.save_sys_bench_results()
+    # Save public ips to a JSON file
+    instance_data = {}
+    for ec2_instance in all_instances:
+        instance_data[ec2_instance.name] = ec2_instance.public_ip
 
-print("Uploading Flask apps to instances...")
-ec2_manager.upload_flask_apps_to_instances()
+    with open("public_ips.json", "w") as file:
+        json.dump(instance_data, file, indent=4)
 
-print("Starting Flask apps for the manager and workers...")
-ec2_manager.start_db_cluster_apps()
+    print("Waiting for the dependencies to be installed...")
+    ec2_manager.wait_until_dependencies_installed(all_instances)
 
-print("Starting Flask app for the proxy...")
-ec2_manager.start_proxy_app()
+    if BAKE_CLUSTER_AMI:
+        print("Baking the cluster AMI...")
+        ec2_manager.bake_cluster_ami()
 
-print("Starting Flask app for the trusted host...")
-ec2_manager.start_trusted_host_app()
+    print("Starting sysbench in the background...")
+    ec2_manager.start_sys_bench()
 
-print("Starting Flask app for the gatekeeper...")
-ec2_manager.start_gatekeeper_app()
+    print("Uploading Flask apps to instances...")
+    ec2_manager.upload_flask_apps_to_instances()
 
-time.sleep(10)
+    print("Waiting for sysbench...")
+    ec2_manager.wait_for_sys_bench()
 
-# benchmark
-while True:
-    print("Benchmarking...")
-    ec2_manager.set_mode("DIRECT_HIT")
-    answers_direct_hit = ec2_manager.benchmark()
-    with open("data/benchmark_direct_hit.json", "w") as file:
-        json.dump(answers_direct_hit, file, indent=4)
-    print_stats(answers_direct_hit)
+    print("Saving sysbench results...")
+    ec2_manager.save_sys_bench_results()
 
-    ec2_manager.set_mode("RANDOM")
-    answers_random = ec2_manager.benchmark()
-    with open("data/benchmark_random.json", "w") as file:
-        json.dump(answers_random, file, indent=4)
-    print_stats(answers_random)
+    print("Setting up the MySQL replication...")
+    ec2_manager.setup_replication()
 
-    ec2_manager.set_mode("CUSTOMIZED")
-    answers_customized = ec2_manager.benchmark()
-    with open("data/benchmark_customized.json", "w") as file:
-        json.dump(answers_customized, file, indent=4)
-    print_stats(answers_customized)
+    print("Starting Flask apps...")
+    ec2_manager.start_flask_apps()
+    ec2_manager.wait_until_apps_ready()
 
-    press_touched = input("Press`b` to benchmark again, any other to cleanup: ")
-    if press_touched != "b":
-        break
+    # benchmark
+    while True:
+        print("Benchmarking...")
+        for mode in ["DIRECT_HIT", "RANDOM", "CUSTOMIZED"]:
+            ec2_manager.set_mode(mode)
+            out_path = f"data/benchmark_{mode.lower()}.jsonl"
+            ec2_manager.benchmark(out_path)
+            print_stats(load_answers(out_path))
 
-# Cleanup
-ec2_manager.cleanup(all_instances)
-print("Cleanup complete.")
+        press_touched = input("Press`b` to benchmark again, any other to cleanup: ")
+        if press_touched != "b":
+            break
 
+finally:
+    # Cleanup
+    ec2_manager.cleanup(ec2_manager.launched_instances)
+    print("Cleanup complete.")
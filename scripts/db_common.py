@@ -0,0 +1,100 @@
+import os
+import mysql.connector.pooling
+import datetime
+import decimal
+from flask import Response
+import msgpack
+
+# Number of rows fetched (and sent) at once when streaming a result
+stream_batch_size = 1000
+
+
+# Function to open the pool of database connections shared by all the requests
+# (32 is the maximum pool size allowed by mysql-connector-python)
+def create_pool(pool_name, config):
+    return mysql.connector.pooling.MySQLConnectionPool(
+        pool_name=pool_name,
+        pool_size=int(os.getenv("POOL_SIZE", "32")),
+        pool_reset_session=False,
+        user=config["MYSQL_DATABASE_USER"],
+        password=config["MYSQL_DATABASE_PASSWORD"],
+        host=config["MYSQL_DATABASE_HOST"],
+        database=config["MYSQL_DATABASE_DB"],
+        # A pooled connection must not keep a read snapshot open from one request to the next
+        autocommit=True,
+        use_pure=False,
+        # A streamed result left unread (client gone) is discarded when its cursor is closed
+        consume_results=True,
+    )
+
+
+# Errors caused by the query itself (syntax, unknown table, bad value...), answered with a 400: they are not a
+# sign of an unhealthy server, and would fail the same way on any other one
+query_errors = (
+    mysql.connector.ProgrammingError,
+    mysql.connector.DataError,
+    mysql.connector.IntegrityError,
+    mysql.connector.NotSupportedError,
+)
+
+
+# Function to get the HTTP status of the answer to a failed query
+def error_status(error):
+    return 400 if isinstance(error, query_errors) else 500
+
+
+# Function to serialize the values msgpack does not support natively
+def msgpack_default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    # Values of SET columns
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+# Function to build a msgpack response (the proxy, the only client of the database apps, decodes it)
+def mpackify(obj):
+    return Response(
+        msgpack.packb(obj, default=msgpack_default), mimetype="application/msgpack"
+    )
+
+
+# Function to execute a read query on an unbuffered cursor (its rows are fetched while they are sent)
+def execute_read(conn, query):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+    except Exception:
+        cursor.close()
+        raise
+    return cursor
+
+
+# Function to stream the rows of an executed query as a sequence of msgpack arrays (one per batch of rows),
+# then give the connection back to the pool. The first batch is fetched and encoded right away, so that an
+# error there is still answered with a 500 (and not with a truncated 200 body once streaming started)
+def stream_rows(conn, cursor):
+    try:
+        first_rows = msgpack.packb(
+            cursor.fetchmany(stream_batch_size), default=msgpack_default
+        )
+    except Exception:
+        cursor.close()
+        raise
+    return stream_remaining_rows(conn, cursor, first_rows)
+
+
+# Function to send the already encoded first batch of rows, then fetch and send the next ones
+def stream_remaining_rows(conn, cursor, first_rows):
+    try:
+        yield first_rows
+        for rows in iter(lambda: cursor.fetchmany(stream_batch_size), []):
+            yield msgpack.packb(rows, default=msgpack_default)
+    finally:
+        cursor.close()
+        conn.close()
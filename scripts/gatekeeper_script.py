@@ -1,11 +1,17 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from flask import Flask, request, jsonify
+from json_provider import OrjsonProvider
 import logging
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
-logging.basicConfig(level=logging.INFO)
+# Per-request logs are only shown with LOG_LEVEL=INFO (they would slow the app down under load)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 
 # read "public_ips.json" file to get the public IPs of the workers
 with open("public_ips.json", "r") as f:
@@ -13,6 +19,41 @@ with open("public_ips.json", "r") as f:
 
 trusted_host_ip = public_ips["trusted_host"]
 
+# URLs of the next hop, built once
+query_url = f"http://{trusted_host_ip}:5000/query"
+mode_url = f"http://{trusted_host_ip}:5000/mode"
+
+# Kept-alive connections to the next hop, shared by all the requests
+session = requests.Session()
+session.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.05),
+    ),
+)
+
+# (connect, read) timeouts of the requests to the next hop
+timeout = (1, 10)
+
+
+# Number of bytes relayed at once from a response of the next hop
+relay_chunk_size = 8192
+
+
+# Function to relay a (streamed) response of the next hop as is, without decoding and re-encoding it
+def relay(response):
+    def body():
+        try:
+            yield from response.iter_content(chunk_size=relay_chunk_size)
+        finally:
+            response.close()
+
+    return app.response_class(
+        body(), status=response.status_code, mimetype="application/json"
+    )
+
 
 @app.route("/", methods=["GET"])
 def home():
@@ -28,9 +69,11 @@ def query():
         if not query:
             return jsonify({"error": "No query provided"}), 400
 
-        url = f"http://{trusted_host_ip}:5000/query"
-        response = requests.post(url, json={"query": query})
-        return jsonify(response.json()), response.status_code
+        # Only the checked query is forwarded, the answer is passed through as is
+        response = session.post(
+            query_url, json={"query": query}, timeout=timeout, stream=True
+        )
+        return relay(response)
 
     except Exception as e:
         app.logger.error(f"Error executing query: {e}")
@@ -39,8 +82,7 @@ def query():
 
 @app.route("/mode", methods=["GET"])
 def get_mode():
-    url = f"http://{trusted_host_ip}:5000/mode"
-    response = requests.get(url)
+    response = session.get(mode_url, timeout=timeout)
     return jsonify(response.json()), response.status_code
 
 
@@ -48,10 +90,10 @@ def get_mode():
 def set_mode():
     data = request.json
     mode = data.get("mode")
-    url = f"http://{trusted_host_ip}:5000/mode"
-    response = requests.post(url, json={"mode": mode})
+    response = session.post(mode_url, json={"mode": mode}, timeout=timeout)
     return jsonify(response.json()), response.status_code
 
 
+# Only for local runs, the instances serve the app with gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000)
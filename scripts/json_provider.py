@@ -0,0 +1,19 @@
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+
+# JSON provider parsing the requests and encoding the JSON responses with orjson (much faster than the stdlib json)
+class OrjsonProvider(DefaultJSONProvider):
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def dumps(self, obj, **kwargs):
+        # Same options as the default provider: sorted keys unless disabled, indented when asked
+        option = 0
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(
+            obj, default=kwargs.get("default", self.default), option=option
+        ).decode()
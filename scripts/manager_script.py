@@ -1,11 +1,12 @@
 import os
-import mysql.connector
-import requests
-import json
-from flask import Flask, request, jsonify
+from flask import Flask, request
+from json_provider import OrjsonProvider
+from db_common import create_pool, error_status, execute_read, mpackify, stream_rows
 import logging
+import re
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # MySQL configurations (using environment variables for security)
 app.config["MYSQL_DATABASE_USER"] = os.getenv("MYSQL_USER", "root")
@@ -13,11 +14,14 @@ app.config["MYSQL_DATABASE_PASSWORD"] = os.getenv("MYSQL_PASSWORD", "root_passwo
 app.config["MYSQL_DATABASE_DB"] = os.getenv("MYSQL_DB", "sakila")
 app.config["MYSQL_DATABASE_HOST"] = os.getenv("MYSQL_HOST", "localhost")
 
-logging.basicConfig(level=logging.INFO)
+# Per-request logs are only shown with LOG_LEVEL=INFO (they would slow the app down under load)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 
-# read "public_ips.json" file to get the public IPs of the workers
-with open("public_ips.json", "r") as f:
-    public_ips = json.load(f)
+# Write queries start with one of these keywords (only the start of the query is scanned)
+write_query_pattern = re.compile(r"\s*(insert|update|delete)", re.IGNORECASE)
+
+# Pool of database connections, opened once and shared by all the requests
+cnxpool = create_pool("manager_pool", app.config)
 
 
 @app.route("/", methods=["GET"])
@@ -27,77 +31,59 @@ def home():
 
 @app.route("/query", methods=["POST"])
 def query():
+    conn = None
     try:
         data = request.json
         query = data.get("query")
 
         if not query:
-            return jsonify({"error": "No query provided"}), 400
+            return mpackify({"error": "No query provided"}), 400
 
         # Check if the query is a read or write query
-        is_write_query = (
-            query.strip().lower().startswith(("insert", "update", "delete"))
-        )
-
-        # Open a new database connection using mysql-connector-python
-        conn = mysql.connector.connect(
-            user=app.config["MYSQL_DATABASE_USER"],
-            password=app.config["MYSQL_DATABASE_PASSWORD"],
-            host=app.config["MYSQL_DATABASE_HOST"],
-            database=app.config["MYSQL_DATABASE_DB"],
-        )
-        cursor = conn.cursor()
+        is_write_query = write_query_pattern.match(query) is not None
+
+        # Take a database connection from the pool (given back to it by conn.close())
+        conn = cnxpool.get_connection()
 
         if is_write_query:
-            # For write queries, execute the query and commit the changes
-            cursor.execute(query)
-            conn.commit()
+            # For write queries, execute the query without a cursor (there are no rows to fetch),
+            # it is committed right away (autocommit)
+            conn.cmd_query(query)
 
+            # The workers MySQL servers replicate the changes by themselves
             app.logger.info(
-                "Write query executed successfully by manager (replicated on workers)"
+                "Write query executed successfully by manager (replicated asynchronously on workers)"
             )
 
-            # Contact the workers with the write query to replicate the changes
-            for (
-                name,
-                ip,
-            ) in public_ips.items():
-                if not name.startswith("worker"):
-                    continue
-                response = requests.post(
-                    f"http://{ip}:5000/query",
-                    json={"query": query},
-                )
-                app.logger.info(
-                    f"Response from worker {name} ({ip}): {response.json()}"
-                )
-
             return (
-                jsonify(
+                mpackify(
                     {
-                        "message": "Write query executed successfully by manager (replicated on workers)",
+                        "message": "Write query executed successfully by manager (replicated asynchronously on workers)",
                     }
                 ),
                 200,
             )
         else:
-            # For read queries, execute and fetch the result
-            cursor.execute(query)
-            result = cursor.fetchall()
-
+            # For read queries, execute and stream the result
+            cursor = execute_read(conn, query)
             app.logger.info("Read query executed successfully by manager")
 
-            return jsonify(result), 200
+            # The rows are fetched while they are sent, the generator then gives the connection back
+            response = app.response_class(
+                stream_rows(conn, cursor), mimetype="application/msgpack-stream"
+            )
+            conn = None
+            return response, 200
 
     except Exception as e:
         app.logger.error(f"Error executing query: {e}")
-        return jsonify({"error": str(e)}), 500
+        return mpackify({"error": str(e)}), error_status(e)
 
     finally:
         if conn:
-            cursor.close()
             conn.close()
 
 
+# Only for local runs, the instances serve the app with gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000)
@@ -1,16 +1,31 @@
+import os
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from flask import Flask, request, jsonify
+from json_provider import OrjsonProvider
+import heapq
 import logging
+import msgpack
+import re
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 # "DIRECT_HIT", "RANDOM" or "CUSTOMIZED"
 mode = "DIRECT_HIT"
 
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Per-request logs are only shown with LOG_LEVEL=INFO (they would slow the app down under load)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 
-logging.basicConfig(level=logging.INFO)
+# Write queries start with one of these keywords (only the start of the query is scanned)
+write_query_pattern = re.compile(r"\s*(insert|update|delete)", re.IGNORECASE)
 
 # read "public_ips.json" file to get the public IPs of the workers
 with open("public_ips.json", "r") as f:
@@ -23,6 +38,205 @@ public_ips = {
     if key.startswith(("worker", "manager"))
 }
 
+# Kept-alive connections to the next hop, shared by all the requests
+session = requests.Session()
+session.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.05),
+    ),
+)
+
+# (connect, read) timeouts of the requests to the next hop
+timeout = (1, 10)
+
+# keep only workers in public ips
+worker_ips = {
+    key: value for key, value in public_ips.items() if key.startswith("worker")
+}
+
+# URLs of the query endpoints, built once
+manager_url = f"http://{public_ips['manager']}:5000/query"
+worker_names = list(worker_ips)
+worker_urls = {key: f"http://{ip}:5000/query" for key, ip in worker_ips.items()}
+
+# CUSTOMIZED mode: moving average of the response time of each worker, updated on each query
+worker_latencies = {key: 0.0 for key in worker_ips}
+latency_smoothing = 0.2
+latency_lock = threading.Lock()
+# CUSTOMIZED mode: response time recorded for a failed request, enough to rank the worker last for a while,
+# without keeping it there for long once it answers again
+failure_latency = 1.0
+# CUSTOMIZED mode: delay after which a backup request is sent to the second best worker
+hedge_delay = 0.02
+hedge_executor = ThreadPoolExecutor(max_workers=64)
+# CUSTOMIZED mode: seconds between two background pings of the workers, sent by their own threads
+# (so that they never wait behind the hedged requests)
+ping_interval = 1
+ping_executor = ThreadPoolExecutor(max_workers=max(len(worker_ips), 1))
+
+# RANDOM mode: number of requests in flight on each worker
+inflight = {key: 0 for key in worker_ips}
+inflight_lock = threading.Lock()
+
+# Seconds during which the answer to a read query is reused (0, the default, disables the cache,
+# which would otherwise hide the differences between the modes in the benchmark)
+read_cache_ttl = float(os.getenv("READ_CACHE_TTL", "0"))
+read_cache_max_size = 10000
+# query -> (expiry time, result), oldest first, cleared on every write
+read_cache = {}
+# Bumped on every write: a read which started before a write does not cache its (maybe older) result
+read_cache_generation = 0
+read_cache_lock = threading.Lock()
+
+
+# Function to decode an answer of the manager or of a worker (msgpack, with a read result
+# streamed as a sequence of arrays of rows)
+def decode_answer(response):
+    if response.headers.get("Content-Type", "").startswith(
+        "application/msgpack-stream"
+    ):
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(response.content)
+        return [row for rows in unpacker for row in rows]
+    return msgpack.unpackb(response.content)
+
+
+# Function to update the moving average response time of a worker with a new measurement
+def record_latency(worker_name, elapsed):
+    with latency_lock:
+        worker_latencies[worker_name] += latency_smoothing * (
+            elapsed - worker_latencies[worker_name]
+        )
+
+
+# Function to record a failed request to a worker in its moving average response time
+def penalize(worker_name):
+    record_latency(worker_name, failure_latency)
+
+
+# Function to send a query to a worker, updating its moving average response time and its in-flight count
+def post_to_worker(worker_name, query):
+    with inflight_lock:
+        inflight[worker_name] += 1
+    start_time = time.perf_counter()
+    try:
+        response = session.post(
+            worker_urls[worker_name],
+            json={"query": query},
+            timeout=timeout,
+        )
+    except requests.exceptions.RequestException:
+        penalize(worker_name)
+        raise
+    finally:
+        with inflight_lock:
+            inflight[worker_name] -= 1
+    if response.status_code >= 500:
+        # A failed answer is no sign of a fast worker, penalize it as well
+        penalize(worker_name)
+    else:
+        record_latency(worker_name, time.perf_counter() - start_time)
+    return worker_name, response
+
+
+# Function to pick two random workers and keep the one with the fewest requests in flight
+def pick_random_worker():
+    if len(worker_names) < 2:
+        return worker_names[0]
+    first, second = random.sample(worker_names, 2)
+    return first if inflight[first] <= inflight[second] else second
+
+
+# Function to ping a single worker, updating its moving average response time
+def ping_worker(worker_name):
+    start_time = time.perf_counter()
+    try:
+        session.get(f"http://{worker_ips[worker_name]}:5000/", timeout=2)
+    except requests.exceptions.RequestException:
+        penalize(worker_name)
+        return
+    record_latency(worker_name, time.perf_counter() - start_time)
+
+
+# Function to ping all the workers at once in the background, so that a worker which gets
+# no more queries (e.g. after a failure) still has an up-to-date response time
+def ping_workers():
+    while True:
+        time.sleep(ping_interval)
+        list(ping_executor.map(ping_worker, worker_names))
+
+
+# Function to check that a finished request to a worker got a successful answer (not an error or a 5xx status,
+# a 4xx is an error of the query itself, which any other worker would answer too)
+def is_successful(future):
+    return future.exception() is None and future.result()[1].status_code < 500
+
+
+# Function to send a query to the best worker, and to the second best one if the first is too slow
+def hedged_post(query):
+    # Only the two best workers are needed, a single linear scan instead of a full sort
+    with latency_lock:
+        ranked_workers = heapq.nsmallest(
+            2, worker_names, key=worker_latencies.__getitem__
+        )
+    futures = [hedge_executor.submit(post_to_worker, ranked_workers[0], query)]
+    wait(futures, timeout=hedge_delay)
+    # Backup request if the best worker did not answer successfully in time
+    if len(ranked_workers) > 1 and not (
+        futures[0].done() and is_successful(futures[0])
+    ):
+        futures.append(hedge_executor.submit(post_to_worker, ranked_workers[1], query))
+
+    # First successful answer wins (the slower request is left to finish in the background)
+    for future in as_completed(futures):
+        if is_successful(future):
+            return future.result()
+    # No successful answer, forward an error answer if there is one
+    for future in futures:
+        if future.exception() is None:
+            return future.result()
+    raise futures[0].exception()
+
+
+# Function to get the cached result of a read query (None if missing or expired), with the current cache generation
+def get_cached_result(query):
+    if not read_cache_ttl:
+        return None, 0
+    with read_cache_lock:
+        cached = read_cache.get(query)
+        generation = read_cache_generation
+    if cached is None or cached[0] < time.monotonic():
+        return None, generation
+    return cached[1], generation
+
+
+# Function to cache the result of a read query, unless a write happened since the read started
+def cache_result(query, result, generation):
+    if not read_cache_ttl:
+        return
+    with read_cache_lock:
+        if generation != read_cache_generation:
+            return
+        read_cache.pop(query, None)
+        if len(read_cache) >= read_cache_max_size:
+            # Evict the oldest cached result
+            del read_cache[next(iter(read_cache))]
+        read_cache[query] = (time.monotonic() + read_cache_ttl, result)
+
+
+# Function to drop all the cached results (after a write)
+def clear_read_cache():
+    global read_cache_generation
+    with read_cache_lock:
+        read_cache_generation += 1
+        read_cache.clear()
+
+
+threading.Thread(target=ping_workers, daemon=True).start()
+
 
 @app.route("/", methods=["GET"])
 def home():
@@ -38,70 +252,49 @@ def query():
         if not query:
             return jsonify({"error": "No query provided"}), 400
 
-        is_write_query = (
-            query.strip().lower().startswith(("insert", "update", "delete"))
-        )
+        is_write_query = write_query_pattern.match(query) is not None
 
         if is_write_query:
-            url = f"http://{public_ips['manager']}:5000/query"
-            response = requests.post(url, json={"query": query})
+            response = session.post(manager_url, json={"query": query}, timeout=timeout)
             response_data = {}
             response_data["handled_by"] = "manager"
-            response_data["result"] = response.json()
+            response_data["result"] = decode_answer(response)
+            # The cached answers may not reflect this write anymore
+            clear_read_cache()
             return jsonify(response_data), response.status_code
 
         else:
             global mode
 
+            cached_result, generation = get_cached_result(query)
+            if cached_result is not None:
+                return jsonify({"handled_by": "cache", "result": cached_result}), 200
+
             if mode == "DIRECT_HIT":
-                url = f"http://{public_ips['manager']}:5000/query"
-                response = requests.post(url, json={"query": query})
+                response = session.post(
+                    manager_url, json={"query": query}, timeout=timeout
+                )
                 response_data = {}
                 response_data["handled_by"] = "manager"
-                response_data["result"] = response.json()
-                return jsonify(response_data), response.status_code
+                response_data["result"] = decode_answer(response)
 
             elif mode == "RANDOM":
-                # keep only workers in public ips
-                worker_ips = {
-                    key: value
-                    for key, value in public_ips.items()
-                    if key.startswith("worker")
-                }
-                target = random.choice(list(worker_ips.keys()))
-                ip = public_ips[target]
-                url = f"http://{ip}:5000/query"
-                response = requests.post(url, json={"query": query})
+                target, response = post_to_worker(pick_random_worker(), query)
                 response_data = {}
                 response_data["handled_by"] = target
-                response_data["result"] = response.json()
-                return jsonify(response_data), response.status_code
+                response_data["result"] = decode_answer(response)
 
             elif mode == "CUSTOMIZED":
-                ping = {}
-                # keep only workers in public ips
-                worker_ips = {
-                    key: value
-                    for key, value in public_ips.items()
-                    if key.startswith("worker")
-                }
-                for key, ip in worker_ips.items():
-                    try:
-                        start_time = time.time()
-                        requests.get(f"http://{ip}:5000/", timeout=2)
-                        ping[key] = time.time() - start_time
-                    except requests.exceptions.RequestException:
-                        ping[key] = float("inf")
-
-                worker_name = min(ping, key=ping.get)
-                ip = public_ips[worker_name]
-                url = f"http://{ip}:5000/query"
-                response = requests.post(url, json={"query": query})
+                worker_name, response = hedged_post(query)
                 response_data = {}
                 response_data["handled_by"] = worker_name
-                response_data["result"] = response.json()
-                response_data["pings"] = ping
-                return jsonify(response_data), response.status_code
+                response_data["result"] = decode_answer(response)
+                with latency_lock:
+                    response_data["latencies"] = dict(worker_latencies)
+
+            if response.status_code == 200:
+                cache_result(query, response_data["result"], generation)
+            return jsonify(response_data), response.status_code
 
     except Exception as e:
         app.logger.error(f"Error executing query: {e}")
@@ -129,5 +322,6 @@ def set_mode():
         return jsonify({"error": str(e)}), 500
 
 
+# Only for local runs, the instances serve the app with gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000)
@@ -1,11 +1,18 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from flask import Flask, request, jsonify
+from json_provider import OrjsonProvider
 import logging
+import time
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
-logging.basicConfig(level=logging.INFO)
+# Per-request logs are only shown with LOG_LEVEL=INFO (they would slow the app down under load)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 
 # read "public_ips.json" file to get the public IPs of the workers
 with open("public_ips.json", "r") as f:
@@ -13,6 +20,52 @@ with open("public_ips.json", "r") as f:
 
 proxy_ip = public_ips["proxy"]
 
+# URLs of the next hop, built once
+query_url = f"http://{proxy_ip}:5000/query"
+mode_url = f"http://{proxy_ip}:5000/mode"
+
+# Kept-alive connections to the next hop, shared by all the requests
+session = requests.Session()
+session.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.05),
+    ),
+)
+
+# (connect, read) timeouts of the requests to the next hop
+timeout = (1, 10)
+
+
+# Last mode answered by the proxy, reused for mode_cache_ttl seconds (the mode only changes through this host)
+mode_cache = {"mode": None, "expiry": 0.0}
+mode_cache_ttl = 1.0
+
+
+# Function to cache the mode answered by the proxy
+def cache_mode(mode):
+    mode_cache["mode"] = mode
+    mode_cache["expiry"] = time.monotonic() + mode_cache_ttl
+
+
+# Number of bytes relayed at once from a response of the next hop
+relay_chunk_size = 8192
+
+
+# Function to relay a (streamed) response of the next hop as is, without decoding and re-encoding it
+def relay(response):
+    def body():
+        try:
+            yield from response.iter_content(chunk_size=relay_chunk_size)
+        finally:
+            response.close()
+
+    return app.response_class(
+        body(), status=response.status_code, mimetype="application/json"
+    )
+
 
 @app.route("/", methods=["GET"])
 def home():
@@ -22,15 +75,16 @@ def home():
 @app.route("/query", methods=["POST"])
 def query():
     try:
-        data = request.json
-        query = data.get("query")
-
-        if not query:
-            return jsonify({"error": "No query provided"}), 400
-
-        url = f"http://{proxy_ip}:5000/query"
-        response = requests.post(url, json={"query": query})
-        return jsonify(response.json()), response.status_code
+        # The request was already checked by the gatekeeper (and is checked again by the proxy),
+        # pass its body through as is
+        response = session.post(
+            query_url,
+            data=request.get_data(),
+            headers={"Content-Type": "application/json"},
+            timeout=timeout,
+            stream=True,
+        )
+        return relay(response)
 
     except Exception as e:
         app.logger.error(f"Error executing query: {e}")
@@ -39,9 +93,12 @@ def query():
 
 @app.route("/mode", methods=["GET"])
 def get_mode():
-    # call proxy to get the mode
-    url = f"http://{proxy_ip}:5000/mode"
-    response = requests.get(url)
+    # answer from the cache while it is fresh, call proxy to get the mode otherwise
+    if mode_cache["mode"] is not None and time.monotonic() < mode_cache["expiry"]:
+        return jsonify({"mode": mode_cache["mode"]}), 200
+    response = session.get(mode_url, timeout=timeout)
+    if response.status_code == 200:
+        cache_mode(response.json()["mode"])
     return jsonify(response.json()), response.status_code
 
 
@@ -50,10 +107,12 @@ def set_mode():
     # call proxy to set the mode
     data = request.json
     mode = data.get("mode")
-    url = f"http://{proxy_ip}:5000/mode"
-    response = requests.post(url, json={"mode": mode})
+    response = session.post(mode_url, json={"mode": mode}, timeout=timeout)
+    if response.status_code == 200:
+        cache_mode(response.json()["mode"])
     return jsonify(response.json()), response.status_code
 
 
+# Only for local runs, the instances serve the app with gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000)
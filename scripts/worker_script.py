@@ -1,9 +1,12 @@
 import os
-import mysql.connector
-from flask import Flask, request, jsonify
+from flask import Flask, request
+from json_provider import OrjsonProvider
+from db_common import create_pool, error_status, execute_read, mpackify, stream_rows
 import logging
+import re
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # MySQL configurations (using environment variables for security)
 app.config["MYSQL_DATABASE_USER"] = os.getenv("MYSQL_USER", "root")
@@ -11,7 +14,14 @@ app.config["MYSQL_DATABASE_PASSWORD"] = os.getenv("MYSQL_PASSWORD", "root_passwo
 app.config["MYSQL_DATABASE_DB"] = os.getenv("MYSQL_DB", "sakila")
 app.config["MYSQL_DATABASE_HOST"] = os.getenv("MYSQL_HOST", "localhost")
 
-logging.basicConfig(level=logging.INFO)
+# Per-request logs are only shown with LOG_LEVEL=INFO (they would slow the app down under load)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+
+# Write queries start with one of these keywords (only the start of the query is scanned)
+write_query_pattern = re.compile(r"\s*(insert|update|delete)", re.IGNORECASE)
+
+# Pool of database connections, opened once and shared by all the requests
+cnxpool = create_pool("worker_pool", app.config)
 
 
 @app.route("/", methods=["GET"])
@@ -21,51 +31,44 @@ def home():
 
 @app.route("/query", methods=["POST"])
 def query():
+    conn = None
     try:
         data = request.json
         query = data.get("query")
 
         if not query:
-            return jsonify({"error": "No query provided"}), 400
+            return mpackify({"error": "No query provided"}), 400
 
-        is_write_query = (
-            query.strip().lower().startswith(("insert", "update", "delete"))
-        )
+        # The worker is a read-only replica, the writes are only done on the manager
+        if write_query_pattern.match(query) is not None:
+            return (
+                mpackify({"error": "Write queries are only accepted by the manager"}),
+                405,
+            )
 
-        # Open a new database connection using mysql-connector-python
-        conn = mysql.connector.connect(
-            user=app.config["MYSQL_DATABASE_USER"],
-            password=app.config["MYSQL_DATABASE_PASSWORD"],
-            host=app.config["MYSQL_DATABASE_HOST"],
-            database=app.config["MYSQL_DATABASE_DB"],
-        )
-        cursor = conn.cursor()
+        # Take a database connection from the pool (given back to it by conn.close())
+        conn = cnxpool.get_connection()
 
-        if is_write_query:
-            # For write queries, execute and commit the transaction
-            cursor.execute(query)
-            conn.commit()
+        # Execute the read query and stream the result
+        cursor = execute_read(conn, query)
+        app.logger.info("Read query executed successfully")
 
-            app.logger.info("Write query executed successfully")
-
-            return jsonify({"message": "Write query executed successfully"}), 200
-        else:
-            # For read queries, execute and fetch the result
-            cursor.execute(query)
-            result = cursor.fetchall()
-            app.logger.info("Read query executed successfully")
-
-            return jsonify(result), 200
+        # The rows are fetched while they are sent, the generator then gives the connection back
+        response = app.response_class(
+            stream_rows(conn, cursor), mimetype="application/msgpack-stream"
+        )
+        conn = None
+        return response, 200
 
     except Exception as e:
         app.logger.error(f"Error executing query: {e}")
-        return jsonify({"error": str(e)}), 500
+        return mpackify({"error": str(e)}), error_status(e)
 
     finally:
         if conn:
-            cursor.close()
             conn.close()
 
 
+# Only for local runs, the instances serve the app with gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000)